@@ -1,23 +1,33 @@
 from fastapi import FastAPI, APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 import asyncio
+import time
 import json
+import re
+import numbers
+import orjson
 import base64
+from io import BytesIO
 from pathlib import Path
+from collections import OrderedDict
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional
 import uuid
 from datetime import datetime
 import pandas as pd
 import sqlite3
+import aiosqlite
 import plotly.graph_objects as go
 import plotly.express as px
-from io import BytesIO
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import google.generativeai as genai
 
 ROOT_DIR = Path(__file__).parent
@@ -25,36 +35,91 @@ load_dotenv(ROOT_DIR / '.env')
 
 # Configure Gemini API
 genai.configure(api_key=os.environ['GEMINI_API_KEY'])
+GEMINI_MODEL = genai.GenerativeModel('gemini-1.5-flash')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
-# SQLite setup
-DATABASE_PATH = ROOT_DIR.parent / "data" / "ai_sql_agent.db"
+# SQLite setup; the data is static, so by default the whole database lives in shared-cache memory
+DATABASE_URI = os.environ.get('SQLITE_DATABASE_URI', 'file:ai_sql_agent?mode=memory&cache=shared')
+
+# An in-memory database only lives as long as a connection to it, so this one stays open until shutdown
+SQLITE_KEEPALIVE_CONN: Optional[sqlite3.Connection] = None
+
+# Schema is static once the CSVs are loaded, so it is computed once in init_database()
+SCHEMA_CACHE: str = ""
+
+# Parquet copies of the CSVs, so later startups skip CSV parsing
+PARQUET_CACHE_DIR = ROOT_DIR.parent / "data" / ".parquet_cache"
+
+def load_csv(csv_path: Path) -> pd.DataFrame:
+    """Load a CSV file, going through a memory-mapped Parquet cache when it is fresh"""
+    cache_path = PARQUET_CACHE_DIR / f"{csv_path.stem}.parquet"
+    if cache_path.exists() and cache_path.stat().st_mtime >= csv_path.stat().st_mtime:
+        return pd.read_parquet(cache_path, engine='pyarrow', memory_map=True)
+    
+    df = pd.read_csv(csv_path, engine='pyarrow')
+    try:
+        PARQUET_CACHE_DIR.mkdir(exist_ok=True)
+        df.to_parquet(cache_path, engine='pyarrow', index=False)
+    except Exception as e:
+        print(f"Error caching {csv_path.name} as Parquet: {e}")
+    return df
+
+# Columns that queries join or group on
+INDEXED_COLUMNS = {'product_id', 'category'}
+DATE_COLUMN_TYPES = {'DATE', 'DATETIME', 'TIMESTAMP'}
+
+def is_date_column(name: str, declared_type: str) -> bool:
+    """Date columns by declared type, or by a whole-word "date" in the name"""
+    name = name.lower()
+    return (
+        declared_type.upper() in DATE_COLUMN_TYPES
+        or name == 'date'
+        or name.endswith('_date')
+        or name.startswith('date_')
+    )
+
+def create_indexes(conn: sqlite3.Connection):
+    """Index join, date and category columns, then refresh planner statistics"""
+    tables = ['ad_sales_table', 'total_sales_table', 'eligibility_table']
+    
+    for table in tables:
+        for col in conn.execute(f"PRAGMA table_info({table})").fetchall():
+            column, declared_type = col[1], col[2]
+            if column in INDEXED_COLUMNS or is_date_column(column, declared_type):
+                conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{table}_{column}" ON {table}("{column}")')
+    
+    conn.execute("ANALYZE")
+    conn.commit()
 
 def init_database():
     """Initialize SQLite database from CSV files"""
+    global SCHEMA_CACHE, SQLITE_KEEPALIVE_CONN
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
+        conn = sqlite3.connect(DATABASE_URI, uri=True, check_same_thread=False)
+        SQLITE_KEEPALIVE_CONN = conn
         
         # Load CSV files
         data_dir = ROOT_DIR.parent / "data"
         
         # Load ad_sales.csv
-        ad_sales_df = pd.read_csv(data_dir / "ad_sales.csv")
+        ad_sales_df = load_csv(data_dir / "ad_sales.csv")
         ad_sales_df.to_sql('ad_sales_table', conn, if_exists='replace', index=False)
         
         # Load total_sales.csv
-        total_sales_df = pd.read_csv(data_dir / "total_sales.csv")
+        total_sales_df = load_csv(data_dir / "total_sales.csv")
         total_sales_df.to_sql('total_sales_table', conn, if_exists='replace', index=False)
         
         # Load eligibility.csv
-        eligibility_df = pd.read_csv(data_dir / "eligibility.csv")
+        eligibility_df = load_csv(data_dir / "eligibility.csv")
         eligibility_df.to_sql('eligibility_table', conn, if_exists='replace', index=False)
         
-        conn.close()
+        create_indexes(conn)
+        
+        SCHEMA_CACHE = get_db_schema()
         print("Database initialized successfully!")
         
     except Exception as e:
@@ -63,7 +128,7 @@ def init_database():
 def get_db_schema():
     """Get database schema for Gemini context"""
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
+        conn = sqlite3.connect(DATABASE_URI, uri=True)
         cursor = conn.cursor()
         
         schema_info = ""
@@ -82,18 +147,244 @@ def get_db_schema():
     except Exception as e:
         return f"Error getting schema: {e}"
 
-def execute_sql_query(sql_query: str):
+async def open_sqlite_connection():
+    """Open a long-lived SQLite connection for the query pool"""
+    conn = await aiosqlite.connect(DATABASE_URI, uri=True)
+    # journal_mode and mmap_size only matter when SQLITE_DATABASE_URI points at a file
+    await conn.execute("PRAGMA journal_mode=WAL")
+    await conn.execute("PRAGMA synchronous=NORMAL")
+    await conn.execute("PRAGMA temp_store=MEMORY")
+    await conn.execute("PRAGMA mmap_size=268435456")
+    return conn
+
+class LRUCache:
+    """Small in-process LRU cache; swap for Redis when running multiple workers"""
+    
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+    
+    def get(self, key):
+        if key not in self._data:
+            return None
+        self._data.move_to_end(key)
+        return self._data[key]
+    
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+    
+    def discard(self, key):
+        self._data.pop(key, None)
+
+# Schema and data are static, so generated SQL and query results never go stale
+SQL_CACHE = LRUCache(maxsize=512)
+CHART_SQL_CACHE = LRUCache(maxsize=512)
+QUERY_RESULT_CACHE = LRUCache(maxsize=512)
+# Only small results are kept, so the result cache stays within maxsize * this many rows
+QUERY_RESULT_CACHE_MAX_ROWS = 1000
+
+def normalize_question(question: str) -> str:
+    """Cache key for a question: collapsed whitespace, case kept since SQL literals are case-sensitive"""
+    return " ".join(question.split())
+
+def normalize_sql(sql_query: str) -> str:
+    """Cache key for a query: collapsed whitespace without a trailing semicolon"""
+    return " ".join(sql_query.split()).rstrip(';')
+
+def clean_sql(sql_query: str) -> str:
+    """Strip markdown formatting Gemini sometimes wraps around SQL"""
+    sql_query = sql_query.strip()
+    if sql_query.startswith('```sql'):
+        sql_query = sql_query.replace('```sql', '').replace('```', '').strip()
+    return sql_query
+
+async def generate_sql(question: str) -> str:
+    """Convert a natural language question to SQL with Gemini"""
+    cache_key = normalize_question(question)
+    cached = SQL_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    response = await GEMINI_MODEL.generate_content_async(build_sql_prompt(question))
+    
+    sql_query = clean_sql(response.text)
+    SQL_CACHE.put(cache_key, sql_query)
+    return sql_query
+
+async def generate_sql_with_template(question: str) -> dict:
+    """Convert a question to SQL plus an answer template in a single Gemini call"""
+    cache_key = normalize_question(question)
+    cached = CHART_SQL_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    response = await GEMINI_MODEL.generate_content_async(
+        build_chart_sql_prompt(question),
+        generation_config={"response_mime_type": "application/json"}
+    )
+    
+    result = json.loads(response.text)
+    result["sql"] = clean_sql(result["sql"])
+    CHART_SQL_CACHE.put(cache_key, result)
+    return result
+
+# Bounds on how many rows a single question can pull into memory
+DEFAULT_ROW_LIMIT = 10000
+MAX_RESULT_ROWS = 100000
+# String literals, quoted identifiers and comments are matched whole so a "limit" inside them is ignored
+SQL_TOKEN_RE = re.compile(
+    r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|\[[^\]]*\]|--[^\n]*|/\*.*?\*/|[()]|\w+|.",
+    re.DOTALL
+)
+
+def has_top_level_limit(sql_query: str) -> bool:
+    """Whether the outer statement has a LIMIT clause, whatever its form"""
+    depth = 0
+    for match in SQL_TOKEN_RE.finditer(sql_query):
+        token = match.group()
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif depth == 0 and token.upper() == 'LIMIT':
+            return True
+    return False
+
+def apply_row_limit(sql_query: str) -> tuple:
+    """Append a LIMIT to SELECT queries without one; returns (query, limit_applied)"""
+    sql_query = sql_query.strip().rstrip(';').strip()
+    if not re.match(r"(SELECT|WITH)\b", sql_query, re.IGNORECASE):
+        return sql_query, False
+    # Any existing outer LIMIT, even one followed by a comment or using an expression, is left alone
+    if has_top_level_limit(sql_query):
+        return sql_query, False
+    # New line so a trailing "--" comment can't swallow the LIMIT; the extra row reveals truncation
+    return f"{sql_query}\nLIMIT {DEFAULT_ROW_LIMIT + 1}", True
+
+async def execute_sql_query(sql_query: str):
     """Execute SQL query and return results"""
+    sql_query, limit_applied = apply_row_limit(sql_query)
+    cache_key = normalize_sql(sql_query)
+    cached = QUERY_RESULT_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+    
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        df = pd.read_sql_query(sql_query, conn)
-        conn.close()
-        return df
+        conn = await SQLITE_POOL.get()
+        try:
+            async with conn.execute(sql_query) as cursor:
+                # Fetch one row past the cap so oversized results are caught without reading them all
+                rows = await cursor.fetchmany(MAX_RESULT_ROWS + 1)
+                columns = [d[0] for d in cursor.description]
+        finally:
+            SQLITE_POOL.put_nowait(conn)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"SQL execution error: {e}")
+    
+    if len(rows) > MAX_RESULT_ROWS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Query returned more than {MAX_RESULT_ROWS} rows; try a more specific question or an aggregate"
+        )
+    
+    truncated = limit_applied and len(rows) > DEFAULT_ROW_LIMIT
+    if truncated:
+        rows = rows[:DEFAULT_ROW_LIMIT]
+    
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    # Downstream prompts and payloads report this instead of treating the cut-off as the total
+    df.attrs['truncated_at'] = DEFAULT_ROW_LIMIT if truncated else None
+    
+    if len(df) <= QUERY_RESULT_CACHE_MAX_ROWS:
+        QUERY_RESULT_CACHE.put(cache_key, df)
+    return df
 
-def generate_chart(df: pd.DataFrame) -> str:
-    """Generate chart if dataframe has exactly 2 columns"""
+PROMPT_MAX_ROWS = 50
+
+def format_results_for_prompt(df: pd.DataFrame) -> str:
+    """Summarize query results for the answer prompt without dumping every row"""
+    if len(df) <= PROMPT_MAX_ROWS:
+        return df.to_string(index=False)
+    
+    results = df.head(PROMPT_MAX_ROWS).to_string(index=False)
+    if df.attrs.get('truncated_at'):
+        results += f"\n... (results truncated at {df.attrs['truncated_at']} rows; the full result is larger)"
+    else:
+        results += f"\n... ({len(df)} total rows)"
+    if not df.select_dtypes(include='number').empty:
+        results += f"\n\nSummary statistics:\n{df.describe().to_string()}"
+    return results
+
+def table_rows(df: pd.DataFrame) -> list:
+    """Row tuples of native values, per column, so int columns aren't upcast to float"""
+    return list(df.itertuples(index=False, name=None))
+
+def table_payload(df: pd.DataFrame) -> dict:
+    """Column names plus row arrays; avoids building one dict per row"""
+    return {
+        "columns": df.columns.tolist(),
+        "rows": table_rows(df),
+        "truncated_at": df.attrs.get('truncated_at')
+    }
+
+def orjson_default(value):
+    """Encode values orjson doesn't handle natively, such as BLOB cells"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(value).decode()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+def encode_rows(df: pd.DataFrame) -> bytes:
+    """Comma-separated JSON row arrays, without the enclosing brackets"""
+    return orjson.dumps(table_rows(df), default=orjson_default)[1:-1]
+
+SIMPLE_ANSWER_MAX_ROWS = 3
+
+def format_value(value) -> str:
+    """Human-friendly formatting for a single result value"""
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, numbers.Integral):
+        return f"{value:,}"
+    if isinstance(value, numbers.Real):
+        return f"{value:,.2f}"
+    return str(value)
+
+def format_simple_answer(df: pd.DataFrame) -> Optional[str]:
+    """Answer scalar and tiny all-numeric results locally instead of asking Gemini"""
+    # NULL/NaN cells (e.g. an aggregate over no rows) need a real explanation, not "total: None"
+    if df.empty or df.isna().to_numpy().any():
+        return None
+    
+    if df.shape == (1, 1):
+        return f"{df.columns[0]}: {format_value(df.iat[0, 0])}"
+    
+    all_numeric = df.shape[1] == df.select_dtypes(include='number').shape[1]
+    if len(df) <= SIMPLE_ANSWER_MAX_ROWS and all_numeric:
+        return "\n".join(
+            ", ".join(f"{col}: {format_value(value)}" for col, value in zip(df.columns, row))
+            for row in df.itertuples(index=False)
+        )
+    return None
+
+def fill_answer_template(answer_template: str, df: pd.DataFrame) -> Optional[str]:
+    """Fill a Gemini answer template with values from the first result row"""
+    if df.empty:
+        return None
+    
+    # Per-column values, so an int column next to a float one isn't upcast to float
+    values = dict(zip(df.columns, next(df.itertuples(index=False, name=None))))
+    values['row_count'] = len(df)
+    try:
+        return answer_template.format_map(values).strip()
+    except (KeyError, IndexError, ValueError, AttributeError, TypeError) as e:
+        print(f"Answer template error: {e}")
+        return None
+
+def generate_chart(df: pd.DataFrame) -> Optional[dict]:
+    """Generate Plotly chart spec if dataframe has exactly 2 columns"""
     if df.shape[1] != 2:
         return None
     
@@ -112,23 +403,118 @@ def generate_chart(df: pd.DataFrame) -> str:
             # Default bar chart
             fig = px.bar(df, x=col1, y=col2, title=f"{col2} by {col1}")
         
-        # Convert to base64
-        buffer = BytesIO()
-        fig.write_image(buffer, format='png', width=800, height=400)
-        buffer.seek(0)
-        chart_base64 = base64.b64encode(buffer.getvalue()).decode()
+        # Return the figure as JSON so the client renders it with Plotly
+        fig.update_layout(height=400)
+        return json.loads(fig.to_json())
+        
+    except Exception as e:
+        print(f"Chart generation error: {e}")
+        return None
+
+# Single matplotlib figure reused across PNG renders; cleared before each chart
+PNG_FIGURE = Figure(figsize=(8, 4))
+FigureCanvasAgg(PNG_FIGURE)
+PNG_BUFFER_SIZE = 64 * 1024
+
+def generate_chart_png(df: pd.DataFrame) -> Optional[str]:
+    """Render the chart as a PNG data URI for clients that can't run Plotly"""
+    if df.shape[1] != 2:
+        return None
+    
+    try:
+        col1, col2 = df.columns
+        
+        PNG_FIGURE.clear()
+        ax = PNG_FIGURE.add_subplot()
+        if pd.api.types.is_numeric_dtype(df[col2]) and (
+            pd.api.types.is_datetime64_any_dtype(df[col1]) or 'date' in col1.lower()
+        ):
+            ax.plot(df[col1].astype(str), df[col2])
+            ax.set_title(f"{col2} over {col1}")
+        else:
+            ax.bar(df[col1].astype(str), df[col2])
+            ax.set_title(f"{col2} by {col1}")
+        ax.set_xlabel(col1)
+        ax.set_ylabel(col2)
+        ax.tick_params(axis='x', labelrotation=45)
+        PNG_FIGURE.tight_layout()
+        
+        # Pre-sized buffer avoids regrowth; low zlib level is much faster for flat chart images
+        buffer = BytesIO(bytes(PNG_BUFFER_SIZE))
+        PNG_FIGURE.savefig(buffer, format='png', pil_kwargs={'compress_level': 3, 'optimize': False})
+        size = buffer.tell()
+        chart_base64 = base64.b64encode(buffer.getbuffer()[:size]).decode()
         
         return f"data:image/png;base64,{chart_base64}"
         
     except Exception as e:
-        print(f"Chart generation error: {e}")
+        print(f"PNG chart generation error: {e}")
         return None
 
 # Initialize database on startup
 init_database()
 
+# Prompt prefixes only depend on the schema, so they are built once
+SQL_PROMPT_PREFIX = f"""You are a data analyst assistant. Convert the following natural language question into a valid SQL query for SQLite database.
+
+Database Schema:
+{SCHEMA_CACHE}
+
+Rules:
+1. Use only the table names: ad_sales_table, total_sales_table, eligibility_table
+2. Return ONLY the SQL query without any explanation
+3. Use proper SQLite syntax
+4. Join tables using product_id when needed
+
+"""
+
+CHART_SQL_PROMPT_PREFIX = f"""You are a data analyst assistant. Convert the following natural language question into a valid SQL query for SQLite database, and write a short answer template for its result.
+
+Database Schema:
+{SCHEMA_CACHE}
+
+Rules:
+1. Use only the table names: ad_sales_table, total_sales_table, eligibility_table
+2. Use proper SQLite syntax
+3. Join tables using product_id when needed
+4. Give every aggregate column a simple snake_case alias
+5. The answer template is a Python str.format string answering the question in one or two sentences
+6. In the template, reference result columns of the first row as {{column_name}} (format specs like {{total:,.2f}} are allowed) and the number of result rows as {{row_count}}
+7. Return ONLY a JSON object of the form {{"sql": "...", "answer_template": "..."}}
+
+"""
+
+def build_sql_prompt(question: str) -> str:
+    """Prompt asking Gemini for the SQL answering a question"""
+    return SQL_PROMPT_PREFIX + f"Question: {question}\n\nSQL Query:"
+
+def build_chart_sql_prompt(question: str) -> str:
+    """Prompt asking Gemini for the SQL plus an answer template as JSON"""
+    return CHART_SQL_PROMPT_PREFIX + f"Question: {question}\n\nJSON:"
+
+def build_answer_prompt(question: str, sql_query: str, df: pd.DataFrame) -> str:
+    """Prompt asking Gemini to turn query results into a human-readable answer"""
+    return f"""Based on the SQL query results, provide a clear, human-readable answer to the original question.
+
+Original Question: {question}
+SQL Query: {sql_query}
+Results: {format_results_for_prompt(df)}
+
+Provide a concise, informative answer:"""
+
+# Pool of aiosqlite connections, filled on startup, so queries don't block the event loop.
+# Shared-cache in-memory databases serialize statements on one shared B-tree, so extra
+# connections buy nothing there; only a file URI (in WAL mode) gets parallel readers.
+IN_MEMORY_DATABASE = 'mode=memory' in DATABASE_URI or ':memory:' in DATABASE_URI
+SQLITE_POOL_SIZE = 1 if IN_MEMORY_DATABASE else 8
+SQLITE_POOL: Optional[asyncio.Queue] = None
+
 # Create the main app
-app = FastAPI(title="AI SQL Agent", description="Natural Language to SQL with Gemini AI")
+app = FastAPI(
+    title="AI SQL Agent",
+    description="Natural Language to SQL with Gemini AI",
+    default_response_class=ORJSONResponse
+)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -136,12 +522,19 @@ api_router = APIRouter(prefix="/api")
 # Pydantic models
 class QuestionRequest(BaseModel):
     question: str
+    include_png: bool = False
+
+class TableData(BaseModel):
+    columns: List[str]
+    rows: List[list]
+    truncated_at: Optional[int] = None
 
 class ChartResponse(BaseModel):
     answer: str
     sql_query: str
-    table_data: List[dict]
-    chart_base64: Optional[str] = None
+    table_data: TableData
+    chart_spec: Optional[dict] = None
+    chart_png: Optional[str] = None
 
 # Routes
 @api_router.get("/")
@@ -151,84 +544,119 @@ async def root():
 @api_router.get("/schema")
 async def get_schema():
     """Get database schema information"""
-    schema = get_db_schema()
+    schema = SCHEMA_CACHE
     return {"schema": schema}
 
+def sse_event(data: dict) -> bytes:
+    """Encode a server-sent event payload"""
+    return b"data: " + orjson.dumps(data, default=orjson_default) + b"\n\n"
+
+# Stream text once this many characters are buffered, or once the oldest buffered text has waited this long
+SSE_BATCH_CHARS = 64
+SSE_BATCH_SECONDS = 0.05
+
+async def batch_text(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Coalesce small text chunks so each SSE write carries a useful payload"""
+    iterator = chunks.__aiter__()
+    end_of_stream = object()
+    
+    async def next_text():
+        try:
+            return await iterator.__anext__()
+        except StopAsyncIteration:
+            return end_of_stream
+    
+    buffer = []
+    size = 0
+    deadline = None
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(next_text())
+            
+            # Only wait with a timeout while text is buffered, so it goes out on time even if Gemini stalls
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                yield "".join(buffer)
+                buffer.clear()
+                size = 0
+                deadline = None
+                continue
+            
+            text = pending.result()
+            pending = None
+            if text is end_of_stream:
+                break
+            if not text:
+                continue
+            
+            buffer.append(text)
+            size += len(text)
+            if deadline is None:
+                deadline = time.monotonic() + SSE_BATCH_SECONDS
+            if size >= SSE_BATCH_CHARS:
+                yield "".join(buffer)
+                buffer.clear()
+                size = 0
+                deadline = None
+        
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        # The client may disconnect mid-stream; don't leave the upstream read running
+        if pending is not None:
+            pending.cancel()
+
 @api_router.post("/ask-question")
 async def ask_question_stream(request: QuestionRequest):
     """Convert natural language to SQL and stream human-readable response"""
     
     async def generate_stream():
         try:
-            # Get database schema
-            schema = get_db_schema()
-            
-            # Create prompt for Gemini
-            prompt = f"""You are a data analyst assistant. Convert the following natural language question into a valid SQL query for SQLite database.
-
-Database Schema:
-{schema}
-
-Rules:
-1. Use only the table names: ad_sales_table, total_sales_table, eligibility_table
-2. Return ONLY the SQL query without any explanation
-3. Use proper SQLite syntax
-4. Join tables using product_id when needed
-
-Question: {request.question}
-
-SQL Query:"""
-
-            # Get SQL from Gemini
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            response = model.generate_content(prompt)
-            
-            sql_query = response.text.strip()
+            # Get SQL from Gemini (cached per question)
+            sql_query = await generate_sql(request.question)
             
-            # Clean SQL query (remove markdown formatting if present)
-            if sql_query.startswith('```sql'):
-                sql_query = sql_query.replace('```sql', '').replace('```', '').strip()
+            # Execute SQL; drop SQL that failed so the question can be retried
+            try:
+                df = await execute_sql_query(sql_query)
+            except HTTPException:
+                SQL_CACHE.discard(normalize_question(request.question))
+                raise
             
-            # Execute SQL
-            df = execute_sql_query(sql_query)
-            
-            # Generate human-readable answer
-            answer_prompt = f"""Based on the SQL query results, provide a clear, human-readable answer to the original question.
-
-Original Question: {request.question}
-SQL Query: {sql_query}
-Results: {df.to_string(index=False)}
-
-Provide a concise, informative answer:"""
-
-            answer_response = model.generate_content(answer_prompt)
-            answer = answer_response.text.strip()
+            simple_answer = format_simple_answer(df)
+            if simple_answer:
+                # Trivial results don't need another Gemini round-trip
+                yield sse_event({"type": "token", "content": simple_answer, "is_complete": False})
+            else:
+                # Stream the answer as Gemini produces it
+                answer_prompt = build_answer_prompt(request.question, sql_query, df)
+                answer_response = await GEMINI_MODEL.generate_content_async(answer_prompt, stream=True)
+                async for text in batch_text(chunk.text async for chunk in answer_response):
+                    chunk_data = {
+                        "type": "token",
+                        "content": text,
+                        "is_complete": False
+                    }
+                    yield sse_event(chunk_data)
             
-            # Stream the answer word by word
-            words = answer.split()
-            for i, word in enumerate(words):
-                chunk_data = {
-                    "type": "token",
-                    "content": word + " ",
-                    "is_complete": i == len(words) - 1
-                }
-                yield f"data: {json.dumps(chunk_data)}\n\n"
-                await asyncio.sleep(0.05)
+            yield sse_event({"type": "token", "content": "", "is_complete": True})
             
             # Send final data
             final_data = {
                 "type": "complete",
                 "sql_query": sql_query,
-                "table_data": df.to_dict('records')
+                "table_data": table_payload(df)
             }
-            yield f"data: {json.dumps(final_data)}\n\n"
+            yield sse_event(final_data)
             
         except Exception as e:
             error_data = {
                 "type": "error",
                 "content": f"Error: {str(e)}"
             }
-            yield f"data: {json.dumps(error_data)}\n\n"
+            yield sse_event(error_data)
     
     return StreamingResponse(
         generate_stream(),
@@ -239,65 +667,68 @@ Provide a concise, informative answer:"""
         }
     )
 
-@api_router.post("/ask-with-chart", response_model=ChartResponse)
+TABLE_ROWS_PER_CHUNK = 1000
+
+def stream_chart_response(header: dict, df: pd.DataFrame) -> AsyncIterator[bytes]:
+    """Stream a ChartResponse JSON document, serializing table rows a chunk at a time"""
+    # Encode the header and first row chunk before any bytes are sent, so serialization
+    # errors still surface as an HTTP error rather than a truncated 200 body
+    opening = (
+        orjson.dumps(header, default=orjson_default)[:-1]
+        + b',"table_data":{"columns":' + orjson.dumps(df.columns.tolist())
+        + b',"truncated_at":' + orjson.dumps(df.attrs.get('truncated_at'))
+        + b',"rows":['
+        + encode_rows(df.iloc[:TABLE_ROWS_PER_CHUNK])
+    )
+    
+    async def body():
+        yield opening
+        for start in range(TABLE_ROWS_PER_CHUNK, len(df), TABLE_ROWS_PER_CHUNK):
+            yield b"," + encode_rows(df.iloc[start:start + TABLE_ROWS_PER_CHUNK])
+        yield b"]}}"
+    
+    return body()
+
+@api_router.post(
+    "/ask-with-chart",
+    responses={200: {"model": ChartResponse}}
+)
 async def ask_with_chart(request: QuestionRequest):
     """Convert natural language to SQL and return result with chart if applicable"""
     
     try:
-        # Get database schema
-        schema = get_db_schema()
+        # Get SQL and answer template from Gemini (cached per question)
+        result = await generate_sql_with_template(request.question)
+        sql_query = result["sql"]
         
-        # Create prompt for Gemini
-        prompt = f"""You are a data analyst assistant. Convert the following natural language question into a valid SQL query for SQLite database.
-
-Database Schema:
-{schema}
-
-Rules:
-1. Use only the table names: ad_sales_table, total_sales_table, eligibility_table
-2. Return ONLY the SQL query without any explanation
-3. Use proper SQLite syntax
-4. Join tables using product_id when needed
-
-Question: {request.question}
-
-SQL Query:"""
-
-        # Get SQL from Gemini
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        response = model.generate_content(prompt)
-        
-        sql_query = response.text.strip()
-        
-        # Clean SQL query
-        if sql_query.startswith('```sql'):
-            sql_query = sql_query.replace('```sql', '').replace('```', '').strip()
-        
-        # Execute SQL
-        df = execute_sql_query(sql_query)
+        # Execute SQL; drop SQL that failed so the question can be retried
+        try:
+            df = await execute_sql_query(sql_query)
+        except HTTPException:
+            CHART_SQL_CACHE.discard(normalize_question(request.question))
+            raise
         
-        # Generate human-readable answer
-        answer_prompt = f"""Based on the SQL query results, provide a clear, human-readable answer to the original question.
-
-Original Question: {request.question}
-SQL Query: {sql_query}
-Results: {df.to_string(index=False)}
-
-Provide a concise, informative answer:"""
-
-        answer_response = model.generate_content(answer_prompt)
-        answer = answer_response.text.strip()
+        # Fill the answer locally; only fall back to a second Gemini call if the template doesn't fit
+        answer = fill_answer_template(result.get("answer_template", ""), df) or format_simple_answer(df)
+        if not answer:
+            answer_prompt = build_answer_prompt(request.question, sql_query, df)
+            answer_response = await GEMINI_MODEL.generate_content_async(answer_prompt)
+            answer = answer_response.text.strip()
         
         # Generate chart if applicable
-        chart_base64 = generate_chart(df)
+        chart_spec = generate_chart(df)
+        chart_png = generate_chart_png(df) if request.include_png else None
         
-        return ChartResponse(
-            answer=answer,
-            sql_query=sql_query,
-            table_data=df.to_dict('records'),
-            chart_base64=chart_base64
-        )
+        header = {
+            "answer": answer,
+            "sql_query": sql_query,
+            "chart_spec": chart_spec,
+            "chart_png": chart_png
+        }
+        return StreamingResponse(stream_chart_response(header, df), media_type="application/json")
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -319,6 +750,18 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_sqlite_client():
+    global SQLITE_POOL
+    SQLITE_POOL = asyncio.Queue(maxsize=SQLITE_POOL_SIZE)
+    for _ in range(SQLITE_POOL_SIZE):
+        SQLITE_POOL.put_nowait(await open_sqlite_connection())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    client.close()
+    if SQLITE_POOL is not None:
+        while not SQLITE_POOL.empty():
+            await SQLITE_POOL.get_nowait().close()
+    if SQLITE_KEEPALIVE_CONN is not None:
+        SQLITE_KEEPALIVE_CONN.close()
\ No newline at end of file
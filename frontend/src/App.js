@@ -44,24 +44,30 @@ const ChatMessage = ({ message, isUser, isStreaming }) => {
 };
 
 const ChartRenderer = ({ chartData }) => {
+  const chartRef = useRef(null);
+
+  // Plotly is loaded from its CDN bundle in public/index.html
+  useEffect(() => {
+    if (!chartData || !chartRef.current || !window.Plotly) return;
+    const node = chartRef.current;
+    window.Plotly.react(node, chartData.data, { ...chartData.layout, autosize: true }, { responsive: true });
+    return () => window.Plotly.purge(node);
+  }, [chartData]);
+
   if (!chartData) return null;
 
   return (
     <div className="mt-4 p-4 bg-white rounded-lg border">
       <h3 className="text-lg font-semibold mb-3">Data Visualization</h3>
-      <img 
-        src={chartData} 
-        alt="Generated Chart" 
-        className="w-full h-auto rounded-lg shadow-sm"
-      />
+      <div ref={chartRef} className="w-full rounded-lg shadow-sm" />
     </div>
   );
 };
 
 const DataTable = ({ data }) => {
-  if (!data || data.length === 0) return null;
+  if (!data || data.rows.length === 0) return null;
 
-  const columns = Object.keys(data[0]);
+  const { columns, rows } = data;
 
   return (
     <div className="mt-4 p-4 bg-white rounded-lg border overflow-x-auto">
@@ -80,20 +86,21 @@ const DataTable = ({ data }) => {
           </tr>
         </thead>
         <tbody className="bg-white divide-y divide-gray-200">
-          {data.slice(0, 10).map((row, index) => (
+          {rows.slice(0, 10).map((row, index) => (
             <tr key={index}>
-              {columns.map((column) => (
+              {columns.map((column, colIndex) => (
                 <td key={column} className="px-6 py-4 whitespace-nowrap text-sm text-gray-900">
-                  {row[column]}
+                  {row[colIndex]}
                 </td>
               ))}
             </tr>
           ))}
         </tbody>
       </table>
-      {data.length > 10 && (
+      {rows.length > 10 && (
         <p className="text-sm text-gray-500 mt-2">
-          Showing first 10 of {data.length} results
+          Showing first 10 of {rows.length}
+          {data.truncated_at ? ` results (truncated at ${data.truncated_at} rows)` : " results"}
         </p>
       )}
     </div>
@@ -113,7 +120,7 @@ function App() {
   const [isLoading, setIsLoading] = useState(false);
   const [currentStreamingMessage, setCurrentStreamingMessage] = useState("");
   const [sqlQuery, setSqlQuery] = useState("");
-  const [tableData, setTableData] = useState([]);
+  const [tableData, setTableData] = useState(null);
   const [chartData, setChartData] = useState(null);
   const messagesEndRef = useRef(null);
 
@@ -141,7 +148,7 @@ function App() {
     setIsLoading(true);
     setCurrentStreamingMessage("");
     setSqlQuery("");
-    setTableData([]);
+    setTableData(null);
     setChartData(null);
 
     try {
@@ -228,12 +235,12 @@ function App() {
     setInput("");
     setIsLoading(true);
     setSqlQuery("");
-    setTableData([]);
+    setTableData(null);
     setChartData(null);
 
     try {
       const response = await axios.post(`${API}/ask-with-chart`, { question });
-      const { answer, sql_query, table_data, chart_base64 } = response.data;
+      const { answer, sql_query, table_data, chart_spec } = response.data;
       
       const aiMessage = {
         id: Date.now() + 1,
@@ -245,7 +252,7 @@ function App() {
       setMessages(prev => [...prev, aiMessage]);
       setSqlQuery(sql_query);
       setTableData(table_data);
-      setChartData(chart_base64);
+      setChartData(chart_spec);
       
     } catch (error) {
       console.error('Error:', error);
@@ -355,7 +362,7 @@ function App() {
         </div>
 
         {/* Results Area */}
-        {(tableData.length > 0 || chartData) && (
+        {(tableData?.rows.length > 0 || chartData) && (
           <div className="max-w-6xl mx-auto mt-6">
             <ChartRenderer chartData={chartData} />
             <DataTable data={tableData} />
@@ -0,0 +1,149 @@
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+
+def test_fill_answer_template_uses_first_row_and_row_count():
+    df = pd.DataFrame.from_records([(1500.5,), (20.0,)], columns=['total'])
+    answer = server.fill_answer_template("Total is {total:,.2f} across {row_count} rows", df)
+    assert answer == "Total is 1,500.50 across 2 rows"
+
+
+def test_fill_answer_template_keeps_int_next_to_float():
+    df = pd.DataFrame.from_records([(1, 67500.0)], columns=['product_id', 'total_revenue'])
+    answer = server.fill_answer_template("Top product {product_id} made {total_revenue:,.2f}", df)
+    assert answer == "Top product 1 made 67,500.00"
+
+
+def test_fill_answer_template_null_aggregate_falls_back():
+    df = pd.DataFrame.from_records([(None,)], columns=['total'])
+    assert server.fill_answer_template("Total is {total:,.2f}", df) is None
+
+
+def test_fill_answer_template_missing_column_falls_back():
+    df = pd.DataFrame.from_records([(1,)], columns=['total'])
+    assert server.fill_answer_template("Total is {revenue}", df) is None
+
+
+def test_fill_answer_template_empty_result():
+    df = pd.DataFrame(columns=['total'])
+    assert server.fill_answer_template("Total is {total}", df) is None
+
+
+def test_table_payload_keeps_integer_columns():
+    df = pd.DataFrame.from_records([(1, 67500.0, "Gaming Laptop")], columns=['product_id', 'revenue', 'name'])
+    payload = server.table_payload(df)
+    assert payload["columns"] == ['product_id', 'revenue', 'name']
+    product_id, revenue, name = payload["rows"][0]
+    assert product_id == 1 and isinstance(product_id, int)
+    assert revenue == 67500.0
+    assert name == "Gaming Laptop"
+
+
+def test_apply_row_limit_injects_limit_with_probe_row():
+    sql, limit_applied = server.apply_row_limit("SELECT * FROM total_sales_table;")
+    assert limit_applied
+    assert sql == f"SELECT * FROM total_sales_table\nLIMIT {server.DEFAULT_ROW_LIMIT + 1}"
+
+
+def test_apply_row_limit_keeps_existing_limits():
+    for sql in ["SELECT * FROM t LIMIT 5", "select * from t limit 5 offset 2", "SELECT * FROM t LIMIT -1"]:
+        assert server.apply_row_limit(sql) == (sql, False)
+
+
+def test_apply_row_limit_keeps_limit_before_trailing_comment():
+    for sql in ["SELECT * FROM t LIMIT 5 -- top five", "SELECT * FROM t LIMIT 5 /* top five */"]:
+        assert server.apply_row_limit(sql) == (sql, False)
+
+
+def test_apply_row_limit_keeps_expression_limit():
+    sql = "SELECT * FROM t LIMIT (SELECT 3)"
+    assert server.apply_row_limit(sql) == (sql, False)
+
+
+def test_apply_row_limit_ignores_limits_in_subqueries_and_literals():
+    for sql in [
+        "WITH a AS (SELECT 1 LIMIT 2) SELECT * FROM a",
+        "SELECT * FROM t WHERE name = 'limit 5' -- no limit here",
+    ]:
+        limited_sql, limit_applied = server.apply_row_limit(sql)
+        assert limit_applied
+        assert limited_sql.endswith(f"\nLIMIT {server.DEFAULT_ROW_LIMIT + 1}")
+
+
+def test_apply_row_limit_ignores_non_select():
+    assert server.apply_row_limit("PRAGMA table_info(t)") == ("PRAGMA table_info(t)", False)
+
+
+def test_format_results_for_prompt_reports_truncation():
+    df = pd.DataFrame({'x': range(100)})
+    df.attrs['truncated_at'] = 100
+    assert "truncated at 100 rows" in server.format_results_for_prompt(df)
+
+
+def test_batch_text_flushes_after_delay_without_new_chunk():
+    async def chunks():
+        yield "hi "
+        await asyncio.sleep(server.SSE_BATCH_SECONDS * 10)
+        yield "x" * server.SSE_BATCH_CHARS
+        yield "tail"
+
+    async def collect():
+        start = time.monotonic()
+        batches = []
+        async for text in server.batch_text(chunks()):
+            batches.append((text, time.monotonic() - start))
+        return batches
+
+    batches = asyncio.run(collect())
+    assert [text for text, _ in batches] == ["hi ", "x" * server.SSE_BATCH_CHARS, "tail"]
+    # The short first chunk goes out on the timer, not when the next chunk arrives
+    assert batches[0][1] < server.SSE_BATCH_SECONDS * 5
+
+
+def test_is_date_column_matches_whole_word_or_declared_type():
+    assert server.is_date_column('date', 'TEXT')
+    assert server.is_date_column('order_date', 'TEXT')
+    assert server.is_date_column('created', 'TIMESTAMP')
+    assert not server.is_date_column('update_count', 'INTEGER')
+    assert not server.is_date_column('candidate_id', 'INTEGER')
+
+
+def test_stream_chart_response_is_one_json_document():
+    import orjson
+
+    df = pd.DataFrame.from_records(
+        [(i, b"\x00\x01") for i in range(server.TABLE_ROWS_PER_CHUNK + 5)],
+        columns=['product_id', 'blob']
+    )
+    df.attrs['truncated_at'] = None
+    header = {"answer": "a", "sql_query": "q", "chart_spec": None, "chart_png": None}
+
+    async def collect():
+        return b"".join([part async for part in server.stream_chart_response(header, df)])
+
+    document = orjson.loads(asyncio.run(collect()))
+    assert document["answer"] == "a"
+    assert document["table_data"]["columns"] == ['product_id', 'blob']
+    assert len(document["table_data"]["rows"]) == server.TABLE_ROWS_PER_CHUNK + 5
+    assert document["table_data"]["rows"][0] == [0, "AAE="]
+
+
+def test_format_simple_answer_formats_scalar():
+    df = pd.DataFrame.from_records([(67500.0,)], columns=['total'])
+    assert server.format_simple_answer(df) == "total: 67,500.00"
+
+
+def test_format_simple_answer_skips_null_and_nan():
+    for value in [None, float('nan')]:
+        df = pd.DataFrame.from_records([(value,)], columns=['total'])
+        assert server.format_simple_answer(df) is None
+    df = pd.DataFrame.from_records([(1, None), (2, 3.5)], columns=['product_id', 'avg_cpc'])
+    assert server.format_simple_answer(df) is None